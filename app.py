@@ -10,8 +10,8 @@ import data_processing
 app = Dash(__name__, use_pages=True, suppress_callback_exceptions=True)
 server = app.server
 
-# Configuração global do DataFrame
-df = data_processing.load_and_process_data()
+# Configuração global do DataFrame (abas em cache no data_processing)
+df = data_processing.get_processed_sheets()
 
 # =============================================
 # LAYOUT PRINCIPAL ATUALIZADO COM NAVEGAÇÃO
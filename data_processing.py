@@ -2,11 +2,14 @@ import os
 import logging
 import pandas as pd
 import numpy as np
+import numexpr as ne
 from datetime import datetime
 import openpyxl
 from openpyxl import Workbook
+import pyexcelerate
 from dash import dcc
 import io
+import functools
 
 # Configuração de logging detalhada
 logging.basicConfig(
@@ -18,34 +21,40 @@ logger = logging.getLogger(__name__)
 # Configuração de caminhos dinâmica
 MOUNT_PATH = '/data' if os.environ.get('RENDER') else os.path.join(os.getcwd(), 'data')
 EXCEL_PATH = os.path.join(MOUNT_PATH, 'b.xlsx')
+PARQUET_PATH = os.path.join(MOUNT_PATH, 'b.parquet')  # Cache das abas já processadas
+
+# Colunas de cada aba, na ordem do layout original
+COLUNAS_PLANILHA = [
+    'data', 'beneficiario', 'valor_transacionado', 'valor_liberado',
+    'taxa_de_juros', 'comissao_agente', 'extra_agente', 'valor_dualcred',
+    'nota_fiscal', 'porcentagem_agente', 'quantidade_parcelas', 'agente',
+    '%trans', '%liberad'
+]
+
+# Número do mês -> nome da aba
+MESES = {
+    1: 'JAN', 2: 'FEV', 3: 'MAR', 4: 'ABR', 5: 'MAI', 6: 'JUN',
+    7: 'JUL', 8: 'AGO', 9: 'SET', 10: 'OUT', 11: 'NOV', 12: 'DEZ'
+}
+
+# Data usada quando a linha não tem data válida
+DATA_PADRAO = pd.Timestamp('2025-01-01')
+
+# Formato aplicado à coluna de datas nas planilhas geradas
+DATE_STYLE = pyexcelerate.Style(format=pyexcelerate.Format('yyyy-mm-dd hh:mm:ss'))
 
 def setup_persistent_environment():
     try:
         os.makedirs(MOUNT_PATH, exist_ok=True)
 
         if not os.path.exists(EXCEL_PATH):
-            wb = Workbook()
-            
-            # Remove sheet padrão vazio se existir
-            if 'Sheet' in wb.sheetnames:
-                del wb['Sheet']
+            # Modo write-only: grava as linhas em streaming e não cria a aba padrão 'Sheet'
+            wb = Workbook(write_only=True)
             
-            # Cria aba JAN com cabeçalhos
-            ws = wb.create_sheet("JAN")
-            headers = [
-                'data', 'beneficiario', 'valor_transacionado', 'valor_liberado',
-                'taxa_de_juros', 'comissao_agente', 'extra_agente', 'valor_dualcred',
-                'nota_fiscal', 'porcentagem_agente', 'quantidade_parcelas', 'agente',
-                '%trans', '%liberad'
-            ]
-            ws.append(headers)
-            
-            # Cria outras abas mensais vazias
-            months = ['FEV', 'MAR', 'ABR', 'MAI', 'JUN', 
-                     'JUL', 'AGO', 'SET', 'OUT', 'NOV', 'DEZ']
-            for month in months:
+            # Cria as abas mensais vazias, apenas com cabeçalhos
+            for month in MESES.values():
                 ws = wb.create_sheet(month)
-                ws.append(headers)
+                ws.append(COLUNAS_PLANILHA)
             
             wb.save(EXCEL_PATH)
         
@@ -57,148 +66,254 @@ def setup_persistent_environment():
         logger.error(f"Falha na configuração inicial: {str(e)}")
         raise
 
+# Tabela de substituição de caracteres usada na sanitização de colunas
+# (str.translate aceita destinos com mais de um caractere, como '%' -> 'porcento')
+_TRADUCAO_COLUNAS = str.maketrans({
+    ' ': '_', '(': None, ')': None, '%': 'porcento',
+    'ç': 'c', 'ã': 'a', 'õ': 'o', 'ó': 'o', 'ô': 'o',
+    'à': 'a', 'é': 'e', 'ê': 'e', 'ú': 'u'
+})
+
+@functools.lru_cache(maxsize=256)
 def sanitize_column_name(col):
     return (
         str(col)
         .strip()
         .lower()
-        .replace(" ", "_")
-        .replace("ç", "c")
-        .replace("ã", "a")
-        .replace("õ", "o")
-        .replace("ó", "o")
-        .replace("ô", "o")
-        .replace("à", "a")
-        .replace("é", "e")
-        .replace("ê", "e")
-        .replace("ú", "u")
-        .replace("%", "porcento")
-        .replace("(", "")
-        .replace(")", "")
+        .translate(_TRADUCAO_COLUNAS)
     )
 
+def separar_abas(df):
+    """Divide o DataFrame consolidado de volta em abas, pela coluna categórica 'aba'"""
+    grupos = dict(tuple(df.groupby('aba', observed=True, sort=False)))
+    vazio = df.iloc[0:0]
+    return {
+        sheet_name: grupos.get(sheet_name, vazio).drop(columns='aba').reset_index(drop=True)
+        for sheet_name in df['aba'].cat.categories
+    }
+
+def salvar_cache_parquet(df):
+    """Grava o DataFrame consolidado (com a coluna 'aba') em Parquet"""
+    try:
+        df.to_parquet(PARQUET_PATH, compression='zstd', index=False)
+        logger.info(f"Cache Parquet atualizado: {PARQUET_PATH}")
+    except Exception as e:
+        logger.warning(f"Falha ao gravar cache Parquet: {str(e)}")
+
+def ler_cache_parquet():
+    """Lê o cache Parquet se ele for mais recente que a planilha; caso contrário retorna None"""
+    try:
+        if not os.path.exists(PARQUET_PATH):
+            return None
+        if os.path.getmtime(PARQUET_PATH) < os.path.getmtime(EXCEL_PATH):
+            return None
+
+        df = pd.read_parquet(PARQUET_PATH)
+
+        # Sem linhas o Parquet não preserva as categorias (abas); relê a planilha
+        if df.empty:
+            return None
+        return df
+    except Exception as e:
+        logger.warning(f"Cache Parquet inválido, relendo planilha: {str(e)}")
+        return None
+
+def calcular_colunas_derivadas(df):
+    """Calcula valor_dualcred, %trans, %liberad e nota_fiscal no próprio DataFrame"""
+    # Expressões fundidas pelo NumExpr, sem arrays temporários
+    vt = df['valor_transacionado'].to_numpy(dtype='float64')
+    vl = df['valor_liberado'].to_numpy(dtype='float64')
+    tj = df['taxa_de_juros'].to_numpy(dtype='float64')
+    ca = df['comissao_agente'].to_numpy(dtype='float64')
+    ea = df['extra_agente'].to_numpy(dtype='float64')
+
+    # Saídas pré-alocadas; arredondamento feito no próprio array
+    vd, pt, pl, nf = (np.empty(len(df)) for _ in range(4))
+    ne.evaluate('vt - vl - tj - ca - ea', out=vd)
+    np.round(vd, 2, out=vd)
+    ne.evaluate('where(vt > 0, vd / vt * 100, 0)', out=pt)
+    ne.evaluate('where(vl > 0, vd / vl * 100, 0)', out=pl)
+    ne.evaluate('vt * 0.032', out=nf)
+    for resultado in (pt, pl, nf):
+        np.round(resultado, 2, out=resultado)
+
+    df['valor_dualcred'] = vd
+    df['%trans'] = pt
+    df['%liberad'] = pl
+    df['nota_fiscal'] = nf
+    return df
+
+def processar_abas(sheets):
+    """Consolida as abas em um único DataFrame e calcula as colunas derivadas de uma vez"""
+    # Mapeamento de colunas
+    column_mapping = {
+        'beneficiário': 'beneficiario',
+        'comissão_agente': 'comissao_agente',
+        'chave_pix_cpf': 'chave_pix',
+        '%_trans': '%trans',
+        '%_liberad': '%liberad',
+        'máquina': 'maquina'
+    }
+
+    # Sanitizar e padronizar colunas de cada aba
+    abas_validas = []
+    abas_com_dados = []
+    for sheet_name, df in sheets.items():
+        try:
+            # Sanitização e mapeamento combinados em um único rename
+            nomes = {}
+            for col in df.columns:
+                nome = sanitize_column_name(col)
+                nomes[col] = column_mapping.get(nome, nome)
+
+            abas_validas.append(sheet_name)
+            if not df.empty:
+                # Nomes repetidos após a sanitização impediriam o concat: mantém o primeiro
+                df = df.rename(columns=nomes)
+                df = df.loc[:, ~df.columns.duplicated()]
+                abas_com_dados.append(df.assign(aba=sheet_name))
+            logger.info(f"Aba {sheet_name} processada com sucesso")
+
+        except Exception as e:
+            logger.error(f"Erro na aba {sheet_name}: {str(e)}")
+            continue
+
+    # Uma única passada colunar sobre todas as abas (o concat alinha as colunas)
+    if abas_com_dados:
+        df = pd.concat(abas_com_dados, ignore_index=True, sort=False, copy=False)
+    else:
+        df = pd.DataFrame(columns=['aba'])
+
+    # Adicionar colunas faltantes com valores padrão (um único assign)
+    faltantes = [col for col in COLUNAS_PLANILHA if col not in df.columns]
+    if faltantes:
+        df = df.assign(**{col: pd.NaT if col == 'data' else 0.0 for col in faltantes})
+
+    # Datas: células de data já chegam como datetime; texto usa formato explícito
+    if not pd.api.types.is_datetime64_any_dtype(df['data']):
+        datas = pd.to_datetime(df['data'], format='%d/%m/%Y', errors='coerce')
+
+        # Texto em outro formato (ISO, com hora...) tenta de novo por inferência,
+        # só nas linhas que falharam; células vazias ficam para a data padrão
+        falhas = df['data'][datas.isna()]
+        texto = falhas[falhas.map(lambda v: isinstance(v, str) and v.strip() != '')]
+        if not texto.empty:
+            datas.loc[texto.index] = pd.to_datetime(
+                texto.str.strip(), format='mixed', dayfirst=True, errors='coerce'
+            )
+            ilegiveis = int(datas.loc[texto.index].isna().sum())
+            if ilegiveis:
+                logger.warning(f"{ilegiveis} datas ilegíveis substituídas pela data padrão")
+        df['data'] = datas
+    df['data'] = df['data'].fillna(DATA_PADRAO)
+
+    # Garantir tipos numéricos; parcelas cabem em inteiros pequenos
+    for col in ['valor_transacionado', 'valor_liberado', 'taxa_de_juros',
+                'comissao_agente', 'extra_agente', 'porcentagem_agente']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    df['quantidade_parcelas'] = pd.to_numeric(
+        pd.to_numeric(df['quantidade_parcelas'], errors='coerce').fillna(0),
+        downcast='integer'
+    )
+
+    # Poucos agentes distintos: categoria economiza memória e acelera filtros/groupby.
+    # Para atribuir um agente novo in-place, use antes .cat.add_categories
+    df['agente'] = df['agente'].astype('category')
+
+    calcular_colunas_derivadas(df)
+
+    # Ordenar colunas conforme layout original; categorias preservam a ordem das abas
+    df = df.reindex(columns=COLUNAS_PLANILHA + ['aba'])
+    df['aba'] = pd.Categorical(df['aba'], categories=abas_validas)
+    return df
+
 def load_and_process_data():
     """Carrega dados mantendo a estrutura por abas"""
     try:
         setup_persistent_environment()
+
+        # Planilha inalterada desde o último processamento: usa o cache
+        df = ler_cache_parquet()
+        if df is not None:
+            logger.info("Dados carregados do cache Parquet")
+            return separar_abas(df)
+
         logger.info("Iniciando processamento de dados...")
 
-        # Mapeamento de colunas
-        column_mapping = {
-            'beneficiário': 'beneficiario',
-            'comissão_agente': 'comissao_agente',
-            'chave_pix_cpf': 'chave_pix',
-            '%_trans': '%trans',
-            '%_liberad': '%liberad',
-            'máquina': 'maquina'
-        }
-
-        # Carregar abas como dicionário de DataFrames
-        sheets = pd.read_excel(EXCEL_PATH, sheet_name=None, engine='openpyxl')
-        
-        # Processar cada aba individualmente
-        processed_sheets = {}
-        for sheet_name, df in sheets.items():
-            try:
-                # Sanitizar e padronizar colunas
-                df.columns = [sanitize_column_name(col) for col in df.columns]
-                df.rename(columns=column_mapping, inplace=True, errors='ignore')
-                
-                # Adicionar colunas faltantes com valores padrão
-                required_columns = [
-                    'data', 'beneficiario', 'valor_transacionado', 'valor_liberado',
-                    'taxa_de_juros', 'comissao_agente', 'extra_agente', 'valor_dualcred',
-                    'nota_fiscal', 'porcentagem_agente', 'quantidade_parcelas', 'agente',
-                    '%trans', '%liberad'
-                ]
-                
-                for col in required_columns:
-                    if col not in df.columns:
-                        df[col] = pd.NaT if col == 'data' else 0.0
-                # Cálculos condicionais
-                df['valor_dualcred'] = (
-                    df['valor_transacionado'] 
-                    - df['valor_liberado'] 
-                    - df['taxa_de_juros'] 
-                    - df['comissao_agente'] 
-                    - df['extra_agente']
-                ).round(2)
-
-                df['%trans'] = np.where(
-                    df['valor_transacionado'] > 0,
-                    (df['valor_dualcred'] / df['valor_transacionado']) * 100,
-                    0
-                ).round(2)
-
-                df['%liberad'] = np.where(
-                    df['valor_liberado'] > 0,
-                    (df['valor_dualcred'] / df['valor_liberado']) * 100,
-                    0
-                ).round(2)
-
-                df['nota_fiscal'] = (df['valor_transacionado'] * 0.032).round(2)
-
-                # Ordenar colunas conforme layout original
-                df = df.reindex(columns=[
-                    'data', 'beneficiario', 'valor_transacionado', 'valor_liberado',
-                    'taxa_de_juros', 'comissao_agente', 'extra_agente', 'valor_dualcred',
-                    'nota_fiscal', 'porcentagem_agente', 'quantidade_parcelas', 'agente',
-                    '%trans', '%liberad'
-                ])
-
-                processed_sheets[sheet_name] = df
-                logger.info(f"Aba {sheet_name} processada com sucesso")
-
-            except Exception as e:
-                logger.error(f"Erro na aba {sheet_name}: {str(e)}")
-                continue
+        # Carregar abas como dicionário de DataFrames (leitor calamine, em Rust)
+        sheets = pd.read_excel(EXCEL_PATH, sheet_name=None, engine='calamine')
 
-        return processed_sheets  # Retorna dicionário de DataFrames
+        df = processar_abas(sheets)
+        salvar_cache_parquet(df)
+
+        return separar_abas(df)  # Retorna dicionário de DataFrames
 
     except Exception as e:
         logger.error(f"Erro crítico: {str(e)}")
         return {}
     
 
+def escrever_abas(destino, abas):
+    """Grava {aba: DataFrame} em xlsx com pyexcelerate (caminho ou buffer)"""
+    wb = pyexcelerate.Workbook()
+    for sheet_name, df in abas.items():
+        # Linhas direto do array NumPy; células vazias precisam ser None (NaN/NaT gerariam XML inválido)
+        linhas = df.to_numpy(dtype=object, na_value=None).tolist()
+        ws = wb.new_sheet(sheet_name, data=[df.columns.tolist()] + linhas)
+        if 'data' in df.columns:
+            ws.set_col_style(df.columns.get_loc('data') + 1, DATE_STYLE)
+    wb.save(destino)
+
+@functools.lru_cache(maxsize=1)
+def carregar_abas_em_cache(excel_mtime):
+    """Carrega as abas uma vez por versão da planilha (mtime como chave do cache)"""
+    abas = load_and_process_data()
+    if not abas:
+        logger.warning("Nenhuma aba válida encontrada")
+    else:
+        logger.info(f"Dados carregados: {len(abas)} abas")
+    return abas
+
+def get_processed_sheets():
+    """Abas processadas; recarrega quando b.xlsx muda, inclusive por outro worker"""
+    try:
+        excel_mtime = os.path.getmtime(EXCEL_PATH)
+    except OSError:
+        excel_mtime = None
+    abas = carregar_abas_em_cache(excel_mtime)
+
+    # Falha na carga (ex.: planilha sendo gravada por outro worker) devolve {}:
+    # não fica no cache, a próxima chamada tenta de novo
+    if not abas:
+        carregar_abas_em_cache.cache_clear()
+    return abas
+
 def salvar_no_excel(df):
     """Salva o DataFrame dividindo as linhas por abas mensais."""
     try:
         logger.info("Salvando dados...")
         setup_persistent_environment()
 
-        # Mapear meses para nomes das abas
-        month_names = {
-            1: 'JAN', 2: 'FEV', 3: 'MAR', 4: 'ABR', 5: 'MAI', 6: 'JUN',
-            7: 'JUL', 8: 'AGO', 9: 'SET', 10: 'OUT', 11: 'NOV', 12: 'DEZ'
-        }
-
-        # Criar um writer para o Excel
-        writer = pd.ExcelWriter(EXCEL_PATH, engine='openpyxl')
-
-        # Dividir o DataFrame por mês e salvar em abas
-        df['data'] = pd.to_datetime(df['data'])
-        df['month'] = df['data'].dt.month.map(month_names)
+        # Dividir o DataFrame por mês em uma única passada (sem alterar o original)
+        datas = pd.to_datetime(df['data'])
+        por_mes = dict(tuple(df.assign(data=datas).groupby(datas.dt.month)))
+        vazio = df.iloc[0:0]
+        abas = {}
 
-        for sheet_name in month_names.values():
-            # Filtrar dados do mês
-            df_month = df[df['month'] == sheet_name].drop(columns=['month'])
+        for month_num, sheet_name in MESES.items():
+            # Dados do mês (aba vazia mantém apenas os cabeçalhos)
+            df_month = por_mes.get(month_num, vazio)
 
             # Garantir a ordem das colunas
-            df_month = df_month.reindex(columns=[
-                'data', 'beneficiario', 'valor_transacionado', 'valor_liberado',
-                'taxa_de_juros', 'comissao_agente', 'extra_agente', 'valor_dualcred',
-                'nota_fiscal', 'porcentagem_agente', 'quantidade_parcelas', 'agente',
-                '%trans', '%liberad'
-            ])
-
-            # Salvar na aba correspondente
-            df_month.to_excel(
-                writer,
-                sheet_name=sheet_name,
-                index=False
-            )
+            df_month = df_month.reindex(columns=COLUNAS_PLANILHA)
+            abas[sheet_name] = df_month
+
+        # Salvar todas as abas de uma vez
+        escrever_abas(EXCEL_PATH, abas)
+        carregar_abas_em_cache.cache_clear()
 
-        writer.close()
+        # Atualiza o cache a partir da memória: a próxima carga não relê a planilha
+        salvar_cache_parquet(processar_abas(abas))
         return True
     except Exception as e:
         logger.error(f"Erro ao salvar: {str(e)}")
@@ -209,27 +324,28 @@ def exportar_dados(processed_sheets):
     try:
         logger.info("Iniciando exportação...")
         buffer = io.BytesIO()
+        abas = {}
         
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            for sheet_name, df in processed_sheets.items():
-                logger.info(f"Exportando aba: {sheet_name}")
+        for sheet_name, df in processed_sheets.items():
+            logger.info(f"Exportando aba: {sheet_name}")
+            
+            # Verificar se df tem as colunas necessárias
+            if df.empty:
+                logger.warning(f"Aba {sheet_name} vazia")
+                continue
                 
-                # Verificar se df tem as colunas necessárias
-                if df.empty:
-                    logger.warning(f"Aba {sheet_name} vazia")
-                    continue
-                    
-                df.to_excel(
-                    writer,
-                    sheet_name=sheet_name,
-                    index=False,
-                    columns=[
-                        'data', 'beneficiario', 'valor_transacionado', 'valor_liberado',
-                        'taxa_de_juros', 'comissao_agente', 'extra_agente', 'valor_dualcred',
-                        'nota_fiscal', 'quantidade_parcelas', 'agente', '%trans', '%liberad'
-                    ]
-                )
+            abas[sheet_name] = df[[
+                'data', 'beneficiario', 'valor_transacionado', 'valor_liberado',
+                'taxa_de_juros', 'comissao_agente', 'extra_agente', 'valor_dualcred',
+                'nota_fiscal', 'quantidade_parcelas', 'agente', '%trans', '%liberad'
+            ]]
         
+        # Planilha sem nenhuma aba não abre no Excel: melhor não gerar download
+        if not abas:
+            logger.warning("Nenhuma aba com dados para exportar")
+            return None
+
+        escrever_abas(buffer, abas)
         buffer.seek(0)
         logger.info("Exportação concluída com sucesso")
         return dcc.send_bytes(
@@ -241,14 +357,3 @@ def exportar_dados(processed_sheets):
     except Exception as e:
         logger.error(f"Erro na exportação: {str(e)}", exc_info=True)  # Log detalhado
         return None
-    
-# Inicialização segura
-try:
-    processed_sheets = load_and_process_data()
-    if not processed_sheets:
-        logger.warning("Nenhuma aba válida encontrada")
-    else:
-        logger.info(f"Dados carregados: {len(processed_sheets)} abas")
-except Exception as e:
-    logger.error(f"Falha crítica: {str(e)}")
-    processed_sheets = {}
\ No newline at end of file
@@ -8,8 +8,8 @@ import data_processing
 # Registra a página
 register_page(__name__, path='/')
 
-# Carrega dados e configurações
-processed_sheets = data_processing.load_and_process_data()
+# Reaproveita as abas em cache no data_processing (uma única leitura da planilha)
+processed_sheets = data_processing.get_processed_sheets()
 
 # Concatena todas as abas e cria fallback para estrutura vazia
 base_columns = [
@@ -219,8 +219,7 @@ def filtrar_dados(start_date, end_date):
         end_date = pd.to_datetime(end_date) if end_date else max_date
         
         mask = (df['data'] >= start_date) & (df['data'] <= end_date)
-        df_filtrado = df.loc[mask].copy()
-        df_filtrado['nota_fiscal'] = (df_filtrado['valor_transacionado'] * 0.032).round(2)
+        df_filtrado = df.loc[mask]
         
         return df_filtrado.to_dict("records")
     except Exception as e:
@@ -288,8 +287,6 @@ def calcular_soma(start_date, end_date):
     prevent_initial_call=True
 )
 def gerenciar_dados(*args):
-    global processed_sheets
-    #processed_sheets = data_processing.load_and_process_data() 
     ctx = dash.callback_context
     triggered_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
 
@@ -307,7 +304,7 @@ def gerenciar_dados(*args):
         
         # 3. Aplicar filtro inicial
         mask = (df['data'] >= start_date) & (df['data'] <= end_date)
-        filtered_df = df.loc[mask].copy()
+        filtered_df = df.loc[mask]
     except Exception as e:
         print(f"Erro no pré-processamento: {str(e)}")
         return dash.no_update, dash.no_update, df.to_dict("records"), []
@@ -318,7 +315,7 @@ def gerenciar_dados(*args):
             return salvar_dados(form_inputs, filtered_df, start_date, end_date)
             
         elif triggered_id == "exportar-btn":
-            export_data = data_processing.exportar_dados(processed_sheets)  # Dicionário de abas
+            export_data = data_processing.exportar_dados(data_processing.get_processed_sheets())  # Dicionário de abas
             return (
             "✅ Planilha exportada com sucesso!",  # Mensagem
             export_data,                          # Dados download
@@ -344,7 +341,7 @@ def salvar_dados(form_inputs, filtered_df, start_date, end_date):
             if col == 'data':
                 # Converter e tratar datas inválidas
                 dt = pd.to_datetime(val, errors='coerce', dayfirst=False)
-                novos_dados[col] = dt if not pd.isna(dt) else pd.Timestamp('2025-01-01')
+                novos_dados[col] = dt if not pd.isna(dt) else data_processing.DATA_PADRAO
                 
             elif col in numeric_cols:
                 novos_dados[col] = round(float(val or 0), 2)
@@ -353,30 +350,17 @@ def salvar_dados(form_inputs, filtered_df, start_date, end_date):
 
         # 2. Garantir substituição de NaT residual
         if pd.isna(novos_dados['data']):
-            novos_dados['data'] = pd.Timestamp('2025-01-01')
+            novos_dados['data'] = data_processing.DATA_PADRAO
             
-        # 2. Cálculos automáticos
+        # 2. Cálculos automáticos (mesmas fórmulas usadas na carga da planilha)
         novos_dados['comissao_agente'] = round(
             novos_dados['valor_liberado'] * (novos_dados['porcentagem_agente'] / 100), 2
         )
-        novos_dados['valor_dualcred'] = (
-            novos_dados['valor_transacionado'] 
-            - novos_dados['valor_liberado'] 
-            - novos_dados['taxa_de_juros'] 
-            - novos_dados['comissao_agente'] 
-            - novos_dados['extra_agente']
-        )
-        novos_dados['%trans'] = round(
-            (novos_dados['valor_dualcred'] / novos_dados['valor_transacionado'] * 100), 2
-        ) if novos_dados['valor_transacionado'] else 0
-        novos_dados['%liberad'] = round(
-            (novos_dados['valor_dualcred'] / novos_dados['valor_liberado'] * 100), 2
-        ) if novos_dados['valor_liberado'] else 0
-        novos_dados['nota_fiscal'] = round(novos_dados['valor_transacionado'] * 0.032, 2)
+        nova_linha = data_processing.calcular_colunas_derivadas(pd.DataFrame([novos_dados]))
 
         # 3. Atualizar DataFrame global
         global df
-        df = pd.concat([df, pd.DataFrame([novos_dados])], ignore_index=True)
+        df = pd.concat([df, nova_linha], ignore_index=True)
         data_processing.salvar_no_excel(df) 
 
         # 4. Reaplicar filtro após atualização
@@ -1,13 +1,35 @@
-from dash import dcc, html, dash_table, Input, Output, callback, register_page
+from dash import dcc, html, dash_table, Input, Output, State, callback, ctx, register_page, no_update
 import pandas as pd
 import data_processing
 import logging
 from datetime import datetime
+import functools
+import collections
 import numpy as np
+from dash.dash_table.Format import Format, Group, Scheme, Symbol
 
 logger = logging.getLogger(__name__)
 register_page(__name__, path='/agents-analysis')
 
+numeric_cols = ['valor_transacionado', 'valor_liberado', 'comissao_agente', 'extra_agente']
+
+# Linhas por página da tabela (paginação feita no servidor)
+TAMANHO_PAGINA = 15
+
+# Formato monetário aplicado pela própria DataTable (ex.: R$ 1,234.56)
+FORMATO_MOEDA = Format(
+    scheme=Scheme.fixed, precision=2, group=Group.yes,
+    symbol=Symbol.yes, symbol_prefix='R$ '
+)
+
+# Colunas da tabela: fixas, montadas uma vez
+COLUNAS_TABELA = [{
+    "name": col.replace('_', ' ').title(),
+    "id": col,
+    "type": "numeric" if col in numeric_cols else "text",
+    **({"format": FORMATO_MOEDA} if col in numeric_cols else {})
+} for col in ['data', 'agente'] + numeric_cols]
+
 # Função auxiliar para limpar e validar dados
 def clean_agent_data(raw_data):
     """Garante a integridade dos dados com fallbacks robustos"""
@@ -21,24 +43,32 @@ def clean_agent_data(raw_data):
         # Criar colunas essenciais se ausentes
         essential_columns = {
             'agente': 'Não Informado',
-            'data': pd.to_datetime('2025-01-01'),
+            'data': data_processing.DATA_PADRAO,
             'valor_transacionado': 0.0,
             'valor_liberado': 0.0,
             'comissao_agente': 0.0,
             'extra_agente': 0.0
         }
 
-        for col, default in essential_columns.items():
-            if col not in df.columns:
-                df[col] = default
+        faltantes = {
+            col: default for col, default in essential_columns.items()
+            if col not in df.columns
+        }
+        if faltantes:
+            # Um único assign evita um bloco novo por coluna
+            df = df.assign(**faltantes)
+            for col in faltantes:
                 logger.warning(f"Coluna '{col}' criada artificialmente")
 
-        # Tratamento de datas
-        df['data'] = pd.to_datetime(df['data'], errors='coerce').fillna(pd.to_datetime('2025-01-01'))
+        # Tratamento de datas (já chegam convertidas de data_processing)
+        if not pd.api.types.is_datetime64_any_dtype(df['data']):
+            df['data'] = pd.to_datetime(df['data'], errors='coerce')
+        df['data'] = df['data'].fillna(data_processing.DATA_PADRAO)
         
         # Tratamento do campo agente
         df['agente'] = (
             df['agente']
+            .astype(object)  # Coluna chega como categoria; fillna exige categorias existentes
             .fillna('Não Informado')
             .astype(str)
             .str.strip()
@@ -51,10 +81,16 @@ def clean_agent_data(raw_data):
             })
         )
 
-        # Garantir tipos numéricos
-        numeric_cols = ['valor_transacionado', 'valor_liberado', 'comissao_agente', 'extra_agente']
-        for col in numeric_cols:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
+        # Garantir tipos numéricos (processar_abas já entrega float; só converte o que vier fora disso)
+        df = df.assign(**{
+            col: (df[col] if pd.api.types.is_float_dtype(df[col])
+                  else pd.to_numeric(df[col], errors='coerce')).fillna(0.0)
+            for col in numeric_cols
+        })
+
+        # Agente como categoria (comparação por código) e datas ordenadas para busca binária
+        df['agente'] = df['agente'].astype('category')
+        df = df.sort_values('data', kind='stable').reset_index(drop=True)
 
         return df
 
@@ -62,7 +98,113 @@ def clean_agent_data(raw_data):
         logger.error(f"Erro na limpeza de dados: {str(e)}")
         return pd.DataFrame(columns=list(essential_columns.keys()))
 
-# Layout atualizado
+def _acumulado(datas, valores, pos=None):
+    """Posições, datas ordenadas e somas acumuladas (com linha zero inicial) de um recorte"""
+    cum = np.zeros((len(valores) + 1, valores.shape[1]), dtype=np.int64)
+    np.cumsum(valores, axis=0, out=cum[1:])
+    return pos, datas, cum
+
+def calcular_acumulados(df):
+    """Somas acumuladas por data, em centavos inteiros: geral (chave None) e por agente"""
+    datas = df['data'].to_numpy()
+    # Centavos em int64: subtrair somas acumuladas não acumula erro de ponto flutuante
+    valores = np.rint(df[numeric_cols].to_numpy(dtype='float64') * 100).astype(np.int64)
+    acumulados = {None: _acumulado(datas, valores)}
+    for agente, pos in df.groupby('agente', observed=True, sort=False).indices.items():
+        acumulados[agente] = _acumulado(datas[pos], valores[pos], pos)
+    return acumulados
+
+class AgentSnapshot(collections.namedtuple(
+        'AgentSnapshot', ['abas', 'df', 'acumulados', 'exibicao', 'opcoes', 'versao'])):
+    """Tudo que vem de uma mesma carga de dados; comparado e hasheado pela versão"""
+    __slots__ = ()
+
+    def __hash__(self):
+        return hash(self.versao)
+
+    def __eq__(self, other):
+        return isinstance(other, AgentSnapshot) and self.versao == other.versao
+
+def montar_snapshot(abas):
+    """Limpa as abas e monta as estruturas derivadas de uma vez"""
+    df = clean_agent_data(abas)
+
+    # Agentes válidos para o dropdown (categorias: sem varrer as linhas)
+    agentes = sorted(
+        agente for agente in df['agente'].astype('category').cat.categories
+        if agente not in [None, 'Não Informado', '']
+    )
+
+    return AgentSnapshot(
+        abas=abas,
+        df=df,
+        acumulados=calcular_acumulados(df),
+        # Só as colunas da tabela; valores seguem numéricos e a formatação fica no navegador.
+        # Datas já em texto ISO (mesmo formato do serializador do Dash): os registros
+        # saem só com str/float e o JSON não passa pelo fallback de Timestamp
+        exibicao=df[['data', 'agente'] + numeric_cols].assign(
+            data=df['data'].dt.strftime('%Y-%m-%dT%H:%M:%S')
+        ),
+        opcoes=[{'label': 'Todos', 'value': 'all'}] +
+               [{'label': agente, 'value': agente} for agente in agentes],
+        # Assinatura do conteúdo: igual em todos os workers para os mesmos dados
+        versao=str(pd.util.hash_pandas_object(df, index=False).sum())
+    )
+
+# Snapshot atual: trocado numa única atribuição, leitores nunca veem partes de cargas diferentes
+_agent_snapshot = None
+
+def get_agent_snapshot():
+    """Snapshot dos dados limpos, refeito só quando a planilha muda"""
+    global _agent_snapshot
+    abas = data_processing.get_processed_sheets()
+    snapshot = _agent_snapshot
+    if snapshot is None or snapshot.abas is not abas:
+        snapshot = montar_snapshot(abas)
+        _agent_snapshot = snapshot
+        # Só libera memória: a versão já faz parte da chave do cache
+        aggregate_for_agent.cache_clear()
+    return snapshot
+
+def get_agent_data():
+    """Retorna o DataFrame limpo da carga atual"""
+    return get_agent_snapshot().df
+
+def recorte_periodo(snapshot, start_date, end_date, selected_agent):
+    """Linhas e totais do período por busca binária, sem máscaras sobre o DataFrame inteiro"""
+    exibicao = snapshot.exibicao
+    chave = selected_agent if selected_agent and selected_agent != 'all' else None
+    if chave not in snapshot.acumulados:
+        return exibicao.iloc[0:0], np.zeros(len(numeric_cols))
+
+    # Datas ordenadas (geral ou do agente): o período vira uma fatia
+    pos, datas, cum = snapshot.acumulados[chave]
+    inicio = datas.searchsorted(start_date, side='left')
+    fim = max(datas.searchsorted(end_date, side='right'), inicio)
+    linhas = exibicao.iloc[inicio:fim] if pos is None else exibicao.iloc[pos[inicio:fim]]
+
+    # Totais: diferença entre duas somas acumuladas, de volta a reais
+    return linhas, (cum[fim] - cum[inicio]) / 100
+
+@functools.lru_cache(maxsize=256)
+def _parse_day(valor):
+    """Data do DatePicker (texto ISO) como datetime64, convertida uma vez por valor"""
+    return np.datetime64(valor, 'ns')
+
+@functools.lru_cache(maxsize=64)
+def aggregate_for_agent(snapshot, start_date, end_date, selected_agent):
+    """Recorte da tabela e totais de um período/agente; a chave inclui a versão do snapshot"""
+    display_df, totais = recorte_periodo(snapshot, start_date, end_date, selected_agent)
+
+    # Gerar estatísticas
+    stats = dict(zip(
+        ['Transações Totais', 'Valor Liberado Total', 'Comissões Totais', 'Extras Totais'],
+        totais.tolist()
+    ))
+
+    return display_df, stats
+
+# Layout atualizado: controles fixos, preenchidos pelo callback da página
 layout = html.Div(
     style={
         'backgroundColor': '#111111', 
@@ -82,150 +224,117 @@ layout = html.Div(
         
         dcc.Interval(
             id='refresh-interval',
-            interval=30*1000,
+            interval=60*1000,
             n_intervals=0
         ),
+
+        dcc.Store(id='agent-data-version'),
         
         dcc.Loading(
             id="loading-analysis",
             type="circle",
             children=[
-                html.Div(id='dynamic-content')
+                html.Div(
+                    id='dynamic-content',
+                    children=[
+                        html.Div(
+                            style={'marginBottom': '30px'},
+                            children=[
+                                dcc.Dropdown(
+                                    id='agent-selector',
+                                    options=[{'label': 'Todos', 'value': 'all'}],
+                                    value='all',
+                                    placeholder="Selecione um agente...",
+                                    style={'width': '100%', 'maxWidth': '400px'}
+                                ),
+                            ]
+                        ),
+                        
+                        html.Div(
+                            style={'marginBottom': '30px'},
+                            children=[
+                                dcc.DatePickerRange(
+                                    id="agent-date-picker",
+                                    display_format="DD/MM/YYYY",
+                                    # Dispara uma vez, só quando início e fim estão escolhidos
+                                    updatemode='bothdates',
+                                    style={'width': '100%'}
+                                )
+                            ]
+                        ),
+                        
+                        dash_table.DataTable(
+                            id='agent-table',
+                            columns=COLUNAS_TABELA,
+                            page_action='custom',
+                            page_current=0,
+                            page_size=TAMANHO_PAGINA,
+                            page_count=1,
+                            style_table={
+                                'overflowX': 'auto',
+                                'marginBottom': '30px'
+                            },
+                            style_cell={
+                                'backgroundColor': '#222222',
+                                'color': '#7FDBFF',
+                                'border': '1px solid #7FDBFF',
+                                'padding': '10px'
+                            },
+                            style_header={
+                                'backgroundColor': '#333333',
+                                'fontWeight': 'bold',
+                                'fontSize': '16px'
+                            }
+                        ),
+                        
+                        html.Div(
+                            id="agent-stats",
+                            style={
+                                'padding': '20px',
+                                'border': '2px solid #7FDBFF',
+                                'borderRadius': '10px'
+                            }
+                        )
+                    ]
+                )
             ]
         )
     ]
 )
 
-# Callback para conteúdo dinâmico
-@callback(
-    Output('dynamic-content', 'children'),
-    Input('refresh-interval', 'n_intervals')
-)
-def update_dynamic_content(n):
-    try:
-        # Carregar e processar dados
-        raw_data = data_processing.load_and_process_data()
-        df = clean_agent_data(raw_data)
-
-        # Configurar datas padrão
-        min_date = df['data'].min() if not df.empty else datetime(2025, 1, 1)
-        max_date = df['data'].max() if not df.empty else datetime(2025, 12, 31)
-
-        # Gerar opções válidas para dropdown
-        valid_agents = [agente for agente in df['agente'].unique() 
-                      if agente not in [None, 'Não Informado', '']]
+def opcoes_controles(snapshot):
+    """Opções do dropdown e limites do calendário a partir dos dados"""
+    df = snapshot.df
+    # Configurar datas padrão
+    min_date = df['data'].min() if not df.empty else datetime(2025, 1, 1)
+    max_date = df['data'].max() if not df.empty else datetime(2025, 12, 31)
 
-        return [
-            html.Div(
-                style={'marginBottom': '30px'},
-                children=[
-                    dcc.Dropdown(
-                        id='agent-selector',
-                        options=[{'label': 'Todos', 'value': 'all'}] + 
-                                [{'label': agente, 'value': agente} 
-                                for agente in sorted(valid_agents)],
-                        value='all',
-                        placeholder="Selecione um agente...",
-                        style={'width': '100%', 'maxWidth': '400px'}
-                    ),
-                ]
-            ),
-            
-            html.Div(
-                style={'marginBottom': '30px'},
-                children=[
-                    dcc.DatePickerRange(
-                        id="agent-date-picker",
-                        min_date_allowed=min_date,
-                        max_date_allowed=max_date,
-                        start_date=min_date,
-                        end_date=max_date,
-                        display_format="DD/MM/YYYY",
-                        style={'width': '100%'}
-                    )
-                ]
-            ),
-            
-            dash_table.DataTable(
-                id='agent-table',
-                page_size=15,
-                style_table={
-                    'overflowX': 'auto',
-                    'marginBottom': '30px'
-                },
-                style_cell={
-                    'backgroundColor': '#222222',
-                    'color': '#7FDBFF',
-                    'border': '1px solid #7FDBFF',
-                    'padding': '10px'
-                },
-                style_header={
-                    'backgroundColor': '#333333',
-                    'fontWeight': 'bold',
-                    'fontSize': '16px'
-                }
-            ),
-            
-            html.Div(
-                id="agent-stats",
-                style={
-                    'padding': '20px',
-                    'border': '2px solid #7FDBFF',
-                    'borderRadius': '10px'
-                }
-            )
-        ]
-    
-    except Exception as e:
-        logger.error(f"Erro crítico: {str(e)}")
-        return html.Div(
-            "Sistema temporariamente indisponível. Tente recarregar a página.",
-            style={'color': '#FF5555', 'textAlign': 'center', 'padding': '50px'}
-        )
+    # Opções do dropdown montadas uma vez por carga, junto com os dados
+    return snapshot.opcoes, min_date, max_date
 
-# Callback para atualização dos dados
-@callback(
-    [Output('agent-table', 'columns'),
-     Output('agent-table', 'data'),
-     Output('agent-stats', 'children')],
-    [Input('agent-date-picker', 'start_date'),
-     Input('agent-date-picker', 'end_date'),
-     Input('agent-selector', 'value')]
-)
-def update_analysis(start_date, end_date, selected_agent):
+def update_analysis(start_date, end_date, selected_agent, page_current=0, page_size=TAMANHO_PAGINA,
+                    snapshot=None):
+    """Colunas, linhas da página atual, resumo financeiro e total de páginas do período/agente"""
     try:
-        df = clean_agent_data(data_processing.load_and_process_data())
+        if snapshot is None:
+            snapshot = get_agent_snapshot()
+        df = snapshot.df
         
         if df.empty:
-            return [], [], html.Div("Nenhum dado disponível para análise")
+            return [], [], html.Div("Nenhum dado disponível para análise"), 1
 
         # Filtrar por datas
-        start_date = pd.to_datetime(start_date) if start_date else df['data'].min()
-        end_date = pd.to_datetime(end_date) if end_date else df['data'].max()
-        
-        filtered_df = df[
-            (df['data'] >= start_date) & 
-            (df['data'] <= end_date)
-        ]
+        start_date = _parse_day(start_date) if start_date else df['data'].min().to_datetime64()
+        end_date = _parse_day(end_date) if end_date else df['data'].max().to_datetime64()
 
-        # Filtrar por agente
-        if selected_agent and selected_agent != 'all':
-            filtered_df = filtered_df[filtered_df['agente'] == selected_agent]
-
-        # Formatar valores
-        display_df = filtered_df.copy()
-        numeric_cols = ['valor_transacionado', 'valor_liberado', 'comissao_agente', 'extra_agente']
-        for col in numeric_cols:
-            display_df[col] = display_df[col].apply(
-                lambda x: f'R$ {x:,.2f}' if pd.notnull(x) else 'R$ 0,00')
-
-        # Gerar estatísticas
-        stats = {
-            'Transações Totais': filtered_df['valor_transacionado'].sum(),
-            'Valor Liberado Total': filtered_df['valor_liberado'].sum(),
-            'Comissões Totais': filtered_df['comissao_agente'].sum(),
-            'Extras Totais': filtered_df['extra_agente'].sum()
-        }
+        # Filtros e totais (memoizados por período/agente)
+        display_df, stats = aggregate_for_agent(snapshot, start_date, end_date, selected_agent)
+
+        # Só a página visível vai para o navegador
+        page_size = page_size or TAMANHO_PAGINA
+        page_count = max(1, -(-len(display_df) // page_size))
+        inicio = min(page_current or 0, page_count - 1) * page_size
+        records = display_df.iloc[inicio:inicio + page_size].to_dict('records')
 
         # Criar layout das estatísticas
         stats_content = [
@@ -247,17 +356,11 @@ def update_analysis(start_date, end_date, selected_agent):
             )
         ]
 
-        # Configurar colunas da tabela
-        columns = [{
-            "name": col.replace('_', ' ').title(),
-            "id": col,
-            "type": "numeric" if col in numeric_cols else "text"
-        } for col in ['data', 'agente'] + numeric_cols]
-
         return (
-            columns,
-            display_df.to_dict('records'),
-            stats_content
+            COLUNAS_TABELA,
+            records,
+            stats_content,
+            page_count
         )
 
     except Exception as e:
@@ -265,4 +368,67 @@ def update_analysis(start_date, end_date, selected_agent):
         return [], [], html.Div(
             "Erro ao carregar dados. Atualizando...",
             style={'color': '#FF5555', 'textAlign': 'center'}
-        )
\ No newline at end of file
+        ), 1
+
+def atualizar_pagina(gatilho, start_date, end_date, selected_agent, page_current, page_size, versao_atual):
+    """Controles, tabela e resumo numa única resposta; gatilho é o id que disparou o callback"""
+    try:
+        # Troca de página: só as linhas mudam
+        if gatilho == 'agent-table':
+            records = update_analysis(start_date, end_date, selected_agent, page_current, page_size)[1]
+            return (no_update,) * 6 + (records,) + (no_update,) * 4
+
+        controles = (no_update,) * 5
+        versao = no_update
+        snapshot = None
+
+        # Carga inicial ou intervalo: só mexe nos controles se os dados mudaram
+        if gatilho in (None, 'refresh-interval'):
+            snapshot = get_agent_snapshot()
+            if snapshot.versao == versao_atual:
+                return (no_update,) * 11
+
+            options, min_date, max_date = opcoes_controles(snapshot)
+            start_date, end_date = min_date, max_date
+            controles = (options, min_date, max_date, start_date, end_date)
+            versao = snapshot.versao
+
+        # Novo filtro ou novos dados: volta para a primeira página
+        return (
+            controles
+            + tuple(update_analysis(start_date, end_date, selected_agent, 0, page_size, snapshot))
+            + (0, versao)
+        )
+
+    except Exception as e:
+        logger.error(f"Erro crítico: {str(e)}")
+        return (no_update,) * 5 + ([], [], html.Div(
+            "Sistema temporariamente indisponível. Tente recarregar a página.",
+            style={'color': '#FF5555', 'textAlign': 'center', 'padding': '50px'}
+        ), 1, 0, None)
+
+# Callback único da página: um round-trip por evento (intervalo, período, agente ou página)
+@callback(
+    [Output('agent-selector', 'options'),
+     Output('agent-date-picker', 'min_date_allowed'),
+     Output('agent-date-picker', 'max_date_allowed'),
+     Output('agent-date-picker', 'start_date'),
+     Output('agent-date-picker', 'end_date'),
+     Output('agent-table', 'columns'),
+     Output('agent-table', 'data'),
+     Output('agent-stats', 'children'),
+     Output('agent-table', 'page_count'),
+     Output('agent-table', 'page_current'),
+     Output('agent-data-version', 'data')],
+    [Input('refresh-interval', 'n_intervals'),
+     Input('agent-date-picker', 'start_date'),
+     Input('agent-date-picker', 'end_date'),
+     Input('agent-selector', 'value'),
+     Input('agent-table', 'page_current'),
+     Input('agent-table', 'page_size')],
+    State('agent-data-version', 'data')
+)
+def update_agent_page(n, start_date, end_date, selected_agent, page_current, page_size, versao_atual):
+    return atualizar_pagina(
+        ctx.triggered_id, start_date, end_date, selected_agent, page_current, page_size, versao_atual
+    )